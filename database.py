@@ -1,22 +1,492 @@
 import sqlite3
 import json
+import queue
+import threading
+import contextlib
+from functools import partial
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import apsw  # optional: thinner driver for the bulk-insert write path
+except ImportError:
+    apsw = None
+
+# Hot SQL kept as constants so sqlite3's statement cache reuses the compiled statements
+# Answered from the UNIQUE(email_id) index alone: it already carries the rowid (id)
+_SQL_EXISTS = 'SELECT 1 FROM emails WHERE email_id = ? LIMIT 1'
+_SQL_ALL_IDS = 'SELECT email_id FROM emails'
+
+# download_date is filled in by the column DEFAULT
+_SQL_INSERT = '''
+    INSERT INTO emails (
+        email_id, subject, from_address, to_address, cc_address,
+        date, body_text, has_attachments, attachment_type,
+        attachment_count, attachment_zip_path, links, folder_path,
+        size_kb
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Databases created before that DEFAULT existed need download_date supplied explicitly
+_SQL_INSERT_WITH_DATE = '''
+    INSERT INTO emails (
+        email_id, subject, from_address, to_address, cc_address,
+        date, body_text, has_attachments, attachment_type,
+        attachment_count, attachment_zip_path, links, folder_path,
+        size_kb, download_date
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# HTML bodies live in email_bodies so list queries never read them
+_SQL_INSERT_BODY = '''
+    INSERT INTO email_bodies (email_rowid, body_html)
+    SELECT id, ? FROM emails WHERE email_id = ?
+'''
+
+# Links are stored one row per URL, keyed by the parent email's rowid
+_SQL_INSERT_LINK = '''
+    INSERT INTO email_links (email_rowid, url, label, type)
+    SELECT id, ?, ?, ? FROM emails WHERE email_id = ?
+'''
+
+# Latest saved copy wins, so a deleted file can be replaced by a new one
+_SQL_INSERT_ATTACHMENT_HASH = 'INSERT OR REPLACE INTO attachment_hashes (sha1, path) VALUES (?, ?)'
+_SQL_ALL_ATTACHMENT_HASHES = 'SELECT sha1, path FROM attachment_hashes'
+
+# Search queries take a {columns} SELECT list (see _select_list)
+_SQL_SEARCH_RECENT = 'SELECT {columns} FROM emails ORDER BY date DESC LIMIT ?'
+
+_SQL_SEARCH_FTS = '''
+    SELECT {columns} FROM emails
+    JOIN emails_fts ON emails.id = emails_fts.rowid
+    WHERE emails_fts MATCH ?
+    ORDER BY emails.date DESC
+    LIMIT ?
+'''
+
+# Field searches go through the FTS index, ranked by relevance
+_SQL_SEARCH_FTS_RANKED = '''
+    SELECT {columns} FROM emails
+    JOIN emails_fts ON emails.id = emails_fts.rowid
+    WHERE emails_fts MATCH ?
+    ORDER BY bm25(emails_fts)
+    LIMIT ?
+'''
+
+# Dates are stored as RFC 2822 strings, which don't sort chronologically, so no range scan here
+_SQL_SEARCH_DATE = 'SELECT {columns} FROM emails WHERE date LIKE ? ORDER BY date DESC LIMIT ?'
+
+# Columns of the emails table, in schema order
+_EMAIL_COLUMNS = (
+    'id', 'email_id', 'subject', 'from_address', 'to_address', 'cc_address',
+    'date', 'body_text', 'has_attachments', 'attachment_type',
+    'attachment_count', 'attachment_zip_path', 'links', 'folder_path',
+    'download_date', 'size_kb',
+)
+
+# One full message, HTML body included
+_SQL_GET_EMAIL = f'''
+    SELECT {', '.join('emails.' + c for c in _EMAIL_COLUMNS)}, email_bodies.body_html
+    FROM emails
+    LEFT JOIN email_bodies ON email_bodies.email_rowid = emails.id
+    WHERE emails.id = ?
+'''
+
+# Contentless FTS tables with rowid deletes need SQLite 3.43+; older versions index from emails
+_CONTENTLESS_FTS = sqlite3.sqlite_version_info >= (3, 43, 0)
+
+# Feeds the FTS index from emails (used instead of 'rebuild', which needs a content table)
+_SQL_FTS_FILL = '''
+    INSERT INTO emails_fts(rowid, subject, body_text, from_address, to_address)
+    SELECT id, subject, body_text, from_address, to_address FROM emails
+'''
+
+# Aggregates kept up to date in the stats table by triggers on emails
+_SQL_STATS = 'SELECT k, v FROM stats'
+
+_SQL_STATS_SEED = '''
+    SELECT
+        COUNT(*),
+        IFNULL(SUM(has_attachments = 1), 0),
+        IFNULL(SUM(attachment_type IN ('link', 'both')), 0),
+        IFNULL(SUM(size_kb), 0),
+        IFNULL(SUM(attachment_count), 0)
+    FROM emails
+'''
+
+_STATS_KEYS = (
+    'total_emails', 'emails_with_attachments', 'emails_with_links',
+    'total_size_kb', 'total_attachments',
+)
+
+# search_emails field -> FTS column
+_FTS_FIELD_COLUMNS = {
+    'subject': 'subject',
+    'from': 'from_address',
+}
+
+
+def _select_list(columns):
+    """Build the SELECT list for a search, so callers can skip the large body columns"""
+    if not columns:
+        return 'emails.*'
+    
+    unknown = [c for c in columns if c not in _EMAIL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown email column(s): {', '.join(unknown)}")
+    return ', '.join(f'emails.{c}' for c in columns)
+
+
+def _fts_prefix_query(column, query):
+    """Build an FTS5 query matching all words of query (last one as a prefix) in one column"""
+    # Quoting every word neutralises FTS5 operators such as " * - : ( ) AND OR NOT
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if not words:
+        return None
+    return f"{column} : ({' '.join(words)}*)"
+
+
+def _row_tuple(email_data):
+    """Build the INSERT parameter tuple for one email"""
+    # URLs go to email_links; the links column only keeps blocked file names (NULL if none)
+    blocked_files = (email_data.get('links') or {}).get('blocked_files')
+    links_json = json.dumps({'blocked_files': blocked_files}, ensure_ascii=False) if blocked_files else None
+    
+    return (
+        email_data['email_id'],
+        email_data['subject'],
+        email_data['from_address'],
+        email_data.get('to_address', ''),
+        email_data.get('cc_address', ''),
+        email_data['date'],
+        email_data['body_text'],
+        email_data['has_attachments'],
+        email_data['attachment_type'],
+        email_data['attachment_count'],
+        email_data.get('attachment_zip_path', ''),
+        links_json,
+        email_data['folder_path'],
+        email_data.get('size_kb', 0)
+    )
+
+
+def _link_rows(email_data):
+    """Yield (url, label, type, email_id) rows for the email_links table"""
+    links = email_data.get('links') or {}
+    email_id = email_data['email_id']
+    
+    # Attachment links are labelled with the attachment's file name and keep their link type
+    for link in links.get('attachment_links', []):
+        yield link['url'], link.get('filename'), link.get('type'), email_id
+    for url in links.get('body_links', []):
+        yield url, None, None, email_id
+
+
+def _body_rows(email_data_list):
+    """Yield (body_html, email_id) rows for the email_bodies table, skipping empty bodies"""
+    for email_data in email_data_list:
+        if email_data.get('body_html'):
+            yield email_data['body_html'], email_data['email_id']
+
+
+def _attachment_hash_rows(email_data_list):
+    """Yield (sha1, path) rows for the attachment_hashes table"""
+    for email_data in email_data_list:
+        yield from email_data.get('attachment_hashes', ())
+
+
+class _Sqlite3Writer:
+    """Write path on the stdlib sqlite3 connection (the default driver)"""
+    
+    integrity_errors = (sqlite3.IntegrityError,)
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+    
+    def execute(self, sql, params=()):
+        return self.cursor.execute(sql, params)
+    
+    def executemany(self, sql, rows):
+        return self.cursor.executemany(sql, rows)
+    
+    @property
+    def in_transaction(self):
+        return self.conn.in_transaction
+    
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+    
+    def close(self):
+        # The connection belongs to EmailDatabase, which closes it
+        pass
+
+
+class _ApswWriter:
+    """Write path on an apsw connection - less per-row overhead in executemany"""
+    
+    def __init__(self, db_file, cached_statements, setup_statements):
+        self.conn = apsw.Connection(db_file, statementcachesize=cached_statements)
+        self.conn.setbusytimeout(5000)  # same default as sqlite3.connect(timeout=5.0)
+        self.cursor = self.conn.cursor()
+        self.integrity_errors = (sqlite3.IntegrityError, apsw.ConstraintError)
+        for sql in setup_statements:
+            self.cursor.execute(sql)
+    
+    def execute(self, sql, params=()):
+        return self.cursor.execute(sql, params)
+    
+    def executemany(self, sql, rows):
+        return self.cursor.executemany(sql, rows)
+    
+    @property
+    def in_transaction(self):
+        return not self.conn.getautocommit()
+    
+    @property
+    def lastrowid(self):
+        return self.conn.last_insert_rowid()
+    
+    def close(self):
+        self.conn.close()
+
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections shared between worker threads"""
+    
+    def __init__(self, connect, size=4):
+        self._connect = connect
+        self._size = size
+        self._created = 0
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take an idle connection, opening a new one while below the pool size"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if self._created < self._size:
+                conn = self._connect()
+                self._created += 1
+                return conn
+        
+        # Pool is full - wait for another thread to release one
+        return self._idle.get()
+    
+    def release(self, conn):
+        """Return a connection to the pool (it stays open)"""
+        self._idle.put(conn)
+    
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 class EmailDatabase:
     """Manage SQLite database for emails"""
     
-    def __init__(self, db_file='emails.db'):
+    # Triggers that keep the FTS table in sync (dropped during bulk imports)
+    _FTS_TRIGGER_AI = '''
+        CREATE TRIGGER IF NOT EXISTS emails_ai AFTER INSERT ON emails BEGIN
+            INSERT INTO emails_fts(rowid, subject, body_text, from_address, to_address)
+            VALUES (new.id, new.subject, new.body_text, new.from_address, new.to_address);
+        END
+    '''
+    
+    _FTS_TRIGGER_AD = '''
+        CREATE TRIGGER IF NOT EXISTS emails_ad AFTER DELETE ON emails BEGIN
+            INSERT INTO emails_fts(emails_fts, rowid, subject, body_text, from_address, to_address)
+            VALUES('delete', old.id, old.subject, old.body_text, old.from_address, old.to_address);
+        END
+    '''
+    
+    _FTS_TRIGGER_AU = '''
+        CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE ON emails BEGIN
+            INSERT INTO emails_fts(emails_fts, rowid, subject, body_text, from_address, to_address)
+            VALUES('delete', old.id, old.subject, old.body_text, old.from_address, old.to_address);
+            INSERT INTO emails_fts(rowid, subject, body_text, from_address, to_address)
+            VALUES (new.id, new.subject, new.body_text, new.from_address, new.to_address);
+        END
+    '''
+    
+    # Contentless FTS drops rows by rowid, so deletes/updates don't replay the old column values
+    _FTS_CONTENTLESS_TRIGGER_AD = '''
+        CREATE TRIGGER IF NOT EXISTS emails_ad AFTER DELETE ON emails BEGIN
+            DELETE FROM emails_fts WHERE rowid = old.id;
+        END
+    '''
+    
+    _FTS_CONTENTLESS_TRIGGER_AU = '''
+        CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE ON emails BEGIN
+            DELETE FROM emails_fts WHERE rowid = old.id;
+            INSERT INTO emails_fts(rowid, subject, body_text, from_address, to_address)
+            VALUES (new.id, new.subject, new.body_text, new.from_address, new.to_address);
+        END
+    '''
+    
+    # Search indexes on emails (the UNIQUE email_id index is not one of them - it catches duplicates)
+    _SECONDARY_INDEXES = {
+        'idx_subject': 'CREATE INDEX IF NOT EXISTS idx_subject ON emails(subject)',
+        'idx_from': 'CREATE INDEX IF NOT EXISTS idx_from ON emails(from_address)',
+        'idx_date': 'CREATE INDEX IF NOT EXISTS idx_date ON emails(date)',
+        'idx_has_attachments': 'CREATE INDEX IF NOT EXISTS idx_has_attachments ON emails(has_attachments)',
+    }
+    
+    def __init__(self, db_file='emails.db', journal_mode='WAL', synchronous='NORMAL',
+                 temp_store='MEMORY', cache_size=-64000, mmap_size=268435456,
+                 journal_size_limit=6144000, cached_statements=256, pool_size=0, page_size=8192,
+                 shared_cache=False, driver='sqlite3'):
         self.db_file = db_file
+        self.cached_statements = cached_statements
+        self.page_size = page_size
+        self.shared_cache = shared_cache
         self.conn = None
         self.cursor = None
+        self._writer = None
+        self.pool = None
+        self.fts_contentless = False
+        self._download_date_default = True
+        self._rows_inserted = 0  # close() refreshes planner stats after large imports
+        
+        # Performance PRAGMAs applied on every new connection (pass mmap_size=0 to disable mmap)
+        self.pragmas = {
+            'journal_mode': journal_mode,
+            'synchronous': synchronous,
+            'temp_store': temp_store,
+            'cache_size': cache_size,
+            'mmap_size': mmap_size,
+            'journal_size_limit': journal_size_limit,
+        }
         self.init_database()
+        
+        # Optional reader pool so searches/statistics can run from several threads
+        if pool_size > 0:
+            self.pool = ConnectionPool(
+                partial(self._open_connection, check_same_thread=False, read_only=True),
+                pool_size
+            )
+        
+        # Writes can move to apsw once the schema exists ('auto': only if it is installed)
+        if driver == 'auto':
+            driver = 'apsw' if apsw is not None else 'sqlite3'
+        if driver == 'apsw':
+            if apsw is None:
+                raise ImportError("driver='apsw' needs the apsw package (pip install apsw)")
+            self._writer = _ApswWriter(
+                self.db_file, self.cached_statements, ['PRAGMA foreign_keys=ON', *self._pragma_statements()]
+            )
+        elif driver != 'sqlite3':
+            raise ValueError(f"Unknown database driver: {driver!r}")
+        self.driver = driver
+    
+    def _pragma_statements(self):
+        """PRAGMA statements for the configured performance settings"""
+        return [f'PRAGMA {name}={value}' for name, value in self.pragmas.items() if value is not None]
+    
+    def _apply_pragmas(self, conn):
+        """Apply performance PRAGMAs to a connection"""
+        for sql in self._pragma_statements():
+            conn.execute(sql)
+    
+    def _open_connection(self, check_same_thread=True, new_database=False, read_only=False):
+        """Open and configure a new connection to the database file"""
+        # Shared cache: all connections of this process use one page cache. Opt-in, because
+        # SQLite discourages it and it adds table-level locking between connections.
+        if self.shared_cache:
+            target, uri = Path(self.db_file).resolve().as_uri() + '?cache=shared&mode=rwc', True
+        else:
+            target, uri = self.db_file, False
+        
+        # Autocommit mode: write transactions are opened explicitly (see _transaction)
+        conn = sqlite3.connect(
+            target,
+            uri=uri,
+            isolation_level=None,
+            cached_statements=self.cached_statements,
+            check_same_thread=check_same_thread
+        )
+        conn.row_factory = sqlite3.Row
+        
+        # Page size can only be chosen before the first table is written (and before WAL)
+        if new_database and self.page_size:
+            conn.execute(f'PRAGMA page_size={self.page_size}')
+        
+        conn.execute('PRAGMA foreign_keys=ON')
+        self._apply_pragmas(conn)
+        
+        # Shared-cache readers would otherwise block on the writer's table locks
+        if self.shared_cache and read_only:
+            conn.execute('PRAGMA read_uncommitted=1')
+        return conn
+    
+    @contextlib.contextmanager
+    def _reader(self):
+        """Connection for read-only queries: a pooled one if the pool is enabled"""
+        if self.pool is None:
+            yield self.conn
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+    
+    def _cursor_execute(self, sql, params=()):
+        """Run a write statement through the active driver"""
+        return self._writer.execute(sql, params)
+    
+    def _cursor_executemany(self, sql, rows):
+        """Run a write statement once per parameter row through the active driver"""
+        return self._writer.executemany(sql, rows)
+    
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run a block in one write transaction (joins the enclosing one if already open)"""
+        if self._writer.in_transaction:
+            yield
+            return
+        
+        # IMMEDIATE takes the write lock up front instead of upgrading on the first INSERT
+        self._cursor_execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            if self._writer.in_transaction:
+                self._cursor_execute('ROLLBACK')
+            raise
+        self._cursor_execute('COMMIT')
     
     def init_database(self):
         """Initialize database and create tables"""
-        self.conn = sqlite3.connect(self.db_file)
+        # Existing databases keep their page size (changing it needs an explicit VACUUM)
+        new_database = not Path(self.db_file).exists()
+        self.conn = self._open_connection(new_database=new_database)
         self.cursor = self.conn.cursor()
+        self.cursor.arraysize = 1000
+        # Schema setup always runs on sqlite3; __init__ may switch writes to apsw afterwards
+        self._writer = _Sqlite3Writer(self.conn)
         
+        with self._transaction():
+            self._create_schema()
+        print(f"✓ Database initialized: {self.db_file}")
+    
+    def _create_schema(self):
+        """Create tables, indexes and triggers that don't exist yet"""
         # Create emails table
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS emails (
@@ -28,168 +498,410 @@ class EmailDatabase:
                 cc_address TEXT,
                 date TEXT,
                 body_text TEXT,
-                body_html TEXT,
                 has_attachments INTEGER DEFAULT 0,
                 attachment_type TEXT DEFAULT 'none',
                 attachment_count INTEGER DEFAULT 0,
                 attachment_zip_path TEXT,
                 links TEXT,
                 folder_path TEXT,
-                download_date TEXT,
+                download_date TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
                 size_kb INTEGER
             )
         ''')
         
+        # Older databases have no DEFAULT on download_date (SQLite can't add one afterwards)
+        columns = {row['name']: row for row in self.conn.execute('PRAGMA table_info(emails)')}
+        self._download_date_default = columns['download_date']['dflt_value'] is not None
+        
+        # Create bodies table - large HTML stays off the pages that list/search queries read
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_bodies (
+                email_rowid INTEGER PRIMARY KEY REFERENCES emails(id) ON DELETE CASCADE,
+                body_html TEXT
+            )
+        ''')
+        self._migrate_bodies()
+        
         # Create indexes for faster search
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_subject ON emails(subject)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_from ON emails(from_address)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON emails(date)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_has_attachments ON emails(has_attachments)')
+        self.create_secondary_indexes()
         
-        # Create FTS5 virtual table for full-text search
+        # Create links table (attachment and body URLs, one row each)
         self.cursor.execute('''
-            CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
-                subject, body_text, from_address, to_address,
-                content=emails,
-                content_rowid=id
+            CREATE TABLE IF NOT EXISTS email_links (
+                email_rowid INTEGER REFERENCES emails(id) ON DELETE CASCADE,
+                url TEXT,
+                label TEXT,
+                type TEXT
             )
         ''')
+        self._migrate_links()
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_links_rowid ON email_links(email_rowid)')
+        
+        # Create attachment content hashes (where the first copy of each file was saved)
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attachment_hashes (
+                sha1 TEXT PRIMARY KEY,
+                path TEXT
+            ) WITHOUT ROWID
+        ''')
+        
+        # Create materialized statistics table, maintained by triggers
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats (
+                k TEXT PRIMARY KEY,
+                v INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # Triggers are recreated on every start, so databases from older versions pick up
+        # the current definitions (NULL has_attachments/attachment_type counts as 0)
+        for trigger in ('emails_stats_ai', 'emails_stats_ad', 'emails_stats_au'):
+            self.cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
         
-        # Create triggers to keep FTS table in sync
         self.cursor.execute('''
-            CREATE TRIGGER IF NOT EXISTS emails_ai AFTER INSERT ON emails BEGIN
-                INSERT INTO emails_fts(rowid, subject, body_text, from_address, to_address)
-                VALUES (new.id, new.subject, new.body_text, new.from_address, new.to_address);
+            CREATE TRIGGER emails_stats_ai AFTER INSERT ON emails BEGIN
+                UPDATE stats SET v = v + CASE k
+                    WHEN 'total_emails' THEN 1
+                    WHEN 'emails_with_attachments' THEN IFNULL(new.has_attachments = 1, 0)
+                    WHEN 'emails_with_links' THEN IFNULL(new.attachment_type IN ('link', 'both'), 0)
+                    WHEN 'total_size_kb' THEN IFNULL(new.size_kb, 0)
+                    WHEN 'total_attachments' THEN IFNULL(new.attachment_count, 0)
+                    ELSE 0 END;
             END
         ''')
         
         self.cursor.execute('''
-            CREATE TRIGGER IF NOT EXISTS emails_ad AFTER DELETE ON emails BEGIN
-                INSERT INTO emails_fts(emails_fts, rowid, subject, body_text, from_address, to_address)
-                VALUES('delete', old.id, old.subject, old.body_text, old.from_address, old.to_address);
+            CREATE TRIGGER emails_stats_ad AFTER DELETE ON emails BEGIN
+                UPDATE stats SET v = v - CASE k
+                    WHEN 'total_emails' THEN 1
+                    WHEN 'emails_with_attachments' THEN IFNULL(old.has_attachments = 1, 0)
+                    WHEN 'emails_with_links' THEN IFNULL(old.attachment_type IN ('link', 'both'), 0)
+                    WHEN 'total_size_kb' THEN IFNULL(old.size_kb, 0)
+                    WHEN 'total_attachments' THEN IFNULL(old.attachment_count, 0)
+                    ELSE 0 END;
             END
         ''')
         
         self.cursor.execute('''
-            CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE ON emails BEGIN
-                INSERT INTO emails_fts(emails_fts, rowid, subject, body_text, from_address, to_address)
-                VALUES('delete', old.id, old.subject, old.body_text, old.from_address, old.to_address);
-                INSERT INTO emails_fts(rowid, subject, body_text, from_address, to_address)
-                VALUES (new.id, new.subject, new.body_text, new.from_address, new.to_address);
+            CREATE TRIGGER emails_stats_au AFTER UPDATE ON emails BEGIN
+                UPDATE stats SET v = v + CASE k
+                    WHEN 'emails_with_attachments' THEN IFNULL(new.has_attachments = 1, 0) - IFNULL(old.has_attachments = 1, 0)
+                    WHEN 'emails_with_links' THEN IFNULL(new.attachment_type IN ('link', 'both'), 0)
+                                                - IFNULL(old.attachment_type IN ('link', 'both'), 0)
+                    WHEN 'total_size_kb' THEN IFNULL(new.size_kb, 0) - IFNULL(old.size_kb, 0)
+                    WHEN 'total_attachments' THEN IFNULL(new.attachment_count, 0) - IFNULL(old.attachment_count, 0)
+                    ELSE 0 END;
             END
         ''')
         
-        self.conn.commit()
-        print(f"✓ Database initialized: {self.db_file}")
+        # Seed the counters once from existing rows (new or pre-stats database)
+        self.cursor.execute('SELECT COUNT(*) FROM stats')
+        if self.cursor.fetchone()[0] != len(_STATS_KEYS):
+            self.cursor.execute('DELETE FROM stats')
+            self.cursor.execute(_SQL_STATS_SEED)
+            self.cursor.executemany(
+                'INSERT INTO stats (k, v) VALUES (?, ?)',
+                zip(_STATS_KEYS, self.cursor.fetchone())
+            )
+        
+        # An FTS index without its sync triggers means a bulk import was killed before its
+        # rebuild: the emails committed since are not indexed yet
+        interrupted_bulk_import = self._bulk_import_interrupted()
+        
+        # Create FTS5 virtual table for full-text search
+        self._create_fts_table()
+        if interrupted_bulk_import:
+            self._finish_bulk_import()
+        
+        # Create triggers to keep FTS table in sync
+        self.enable_fts_triggers()
+    
+    def _bulk_import_interrupted(self):
+        """True if the FTS table exists but its insert trigger is gone (see bulk_mode)"""
+        names = {row['name'] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE name IN ('emails_fts', 'emails_ai')"
+        )}
+        return names == {'emails_fts'}
+    
+    def _create_fts_table(self):
+        """Create the FTS index - contentless when SQLite supports it, else external-content"""
+        row = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'emails_fts'").fetchone()
+        
+        # Recreate indexes from older versions: no prefix index yet, or external-content
+        # although this SQLite supports contentless_delete
+        if row and ('prefix' not in row['sql']
+                    or (_CONTENTLESS_FTS and 'contentless_delete' not in row['sql'])):
+            self.disable_fts_triggers()
+            self.cursor.execute('DROP TABLE emails_fts')
+            row = None
+        
+        if row is None:
+            if _CONTENTLESS_FTS:
+                options = "content='', contentless_delete=1"
+            else:
+                options = 'content=emails, content_rowid=id'
+            # prefix: 2-4 character prefixes are indexed, so 'term*' queries skip the range scan
+            self.cursor.execute(f'''
+                CREATE VIRTUAL TABLE emails_fts USING fts5(
+                    subject, body_text, from_address, to_address,
+                    {options}, prefix='2 3 4'
+                )
+            ''')
+            self.cursor.execute(_SQL_FTS_FILL)
+            self.fts_contentless = _CONTENTLESS_FTS
+        else:
+            self.fts_contentless = 'contentless_delete' in row['sql']
+    
+    def _migrate_bodies(self):
+        """Move body_html out of the emails table of databases created before email_bodies"""
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(emails)')}
+        if 'body_html' not in columns:
+            return
+        
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO email_bodies (email_rowid, body_html)
+            SELECT id, body_html FROM emails WHERE body_html IS NOT NULL AND body_html != ''
+        ''')
+        try:
+            self.cursor.execute('ALTER TABLE emails DROP COLUMN body_html')
+        except sqlite3.OperationalError:
+            # SQLite < 3.35 can't drop columns; the old column is simply left NULL for new rows
+            pass
+    
+    def _migrate_links(self):
+        """Add the link type column to email_links tables created before it existed"""
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(email_links)')}
+        if 'type' not in columns:
+            self.cursor.execute('ALTER TABLE email_links ADD COLUMN type TEXT')
+    
+    def disable_fts_triggers(self):
+        """Drop the FTS sync triggers (call rebuild_fts_index() and enable_fts_triggers() afterwards)"""
+        with self._transaction():
+            for trigger in ('emails_ai', 'emails_ad', 'emails_au'):
+                self._cursor_execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    
+    def enable_fts_triggers(self):
+        """(Re)create the FTS sync triggers"""
+        if self.fts_contentless:
+            triggers = (self._FTS_TRIGGER_AI, self._FTS_CONTENTLESS_TRIGGER_AD, self._FTS_CONTENTLESS_TRIGGER_AU)
+        else:
+            triggers = (self._FTS_TRIGGER_AI, self._FTS_TRIGGER_AD, self._FTS_TRIGGER_AU)
+        
+        with self._transaction():
+            for trigger_sql in triggers:
+                self._cursor_execute(trigger_sql)
+    
+    def rebuild_fts_index(self):
+        """Rebuild the full-text index from the emails table in one pass"""
+        if self.fts_contentless:
+            # 'rebuild' needs a content table - clear the index and re-feed it instead
+            with self._transaction():
+                self._cursor_execute("INSERT INTO emails_fts(emails_fts) VALUES('delete-all')")
+                self._cursor_execute(_SQL_FTS_FILL)
+        else:
+            self._cursor_execute("INSERT INTO emails_fts(emails_fts) VALUES('rebuild')")
+    
+    def drop_secondary_indexes(self):
+        """Drop the search indexes on emails (call create_secondary_indexes() afterwards)"""
+        with self._transaction():
+            for index in self._SECONDARY_INDEXES:
+                self._cursor_execute(f'DROP INDEX IF EXISTS {index}')
+    
+    def create_secondary_indexes(self):
+        """(Re)create the search indexes on emails"""
+        with self._transaction():
+            for index_sql in self._SECONDARY_INDEXES.values():
+                self._cursor_execute(index_sql)
+    
+    def _finish_bulk_import(self):
+        """Build the search indexes and the FTS index that bulk_mode left out"""
+        self.create_secondary_indexes()
+        self.rebuild_fts_index()
+    
+    @contextlib.contextmanager
+    def bulk_mode(self):
+        """
+        Bulk import: search indexes and FTS triggers are off inside the block; on exit
+        the indexes are built once, the FTS index is rebuilt in one pass, the triggers
+        come back and planner statistics are refreshed.
+        Until then the database is not consistent (search misses the new emails); if the
+        process dies inside the block, the next open finishes the import instead
+        """
+        self.drop_secondary_indexes()
+        self.disable_fts_triggers()
+        try:
+            yield self
+        finally:
+            try:
+                self._finish_bulk_import()
+                self.optimize()
+            finally:
+                self.enable_fts_triggers()
     
     def email_exists(self, email_id):
         """Check if email already exists in database"""
-        self.cursor.execute('SELECT id FROM emails WHERE email_id = ?', (email_id,))
+        self.cursor.execute(_SQL_EXISTS, (email_id,))
         return self.cursor.fetchone() is not None
     
+    def existing_ids_iter(self, arraysize=10000):
+        """Stream all stored email_ids in chunks to keep memory bounded"""
+        cursor = self.conn.cursor()
+        cursor.arraysize = arraysize
+        cursor.execute(_SQL_ALL_IDS)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                yield row[0]
+    
+    def load_existing_ids(self):
+        """Load all stored email_ids into a set for fast membership tests during a sync"""
+        return set(self.existing_ids_iter())
+    
+    def load_attachment_hashes(self):
+        """Load {sha1: path} of saved attachments, to link duplicates instead of rewriting them"""
+        with self._reader() as conn:
+            return dict(conn.execute(_SQL_ALL_ATTACHMENT_HASHES).fetchall())
+    
+    def _insert_statement(self, batch):
+        """INSERT SQL for this schema plus a lazy generator of its parameter rows"""
+        rows = map(_row_tuple, batch)
+        if self._download_date_default:
+            return _SQL_INSERT, rows
+        
+        # Legacy schema: one Python timestamp per batch
+        download_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return _SQL_INSERT_WITH_DATE, (row + (download_date,) for row in rows)
+    
     def insert_email(self, email_data):
         """Insert email into database"""
         try:
-            # Convert links to JSON string
-            links_json = json.dumps(email_data.get('links', {}), ensure_ascii=False)
+            sql, rows = self._insert_statement([email_data])
+            with self._transaction():
+                self._cursor_execute(sql, next(rows))
+                rowid = self._writer.lastrowid
+                self._cursor_executemany(_SQL_INSERT_BODY, _body_rows([email_data]))
+                self._cursor_executemany(_SQL_INSERT_LINK, _link_rows(email_data))
+                self._cursor_executemany(_SQL_INSERT_ATTACHMENT_HASH, _attachment_hash_rows([email_data]))
             
-            self.cursor.execute('''
-                INSERT INTO emails (
-                    email_id, subject, from_address, to_address, cc_address,
-                    date, body_text, body_html, has_attachments, attachment_type,
-                    attachment_count, attachment_zip_path, links, folder_path,
-                    download_date, size_kb
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                email_data['email_id'],
-                email_data['subject'],
-                email_data['from_address'],
-                email_data.get('to_address', ''),
-                email_data.get('cc_address', ''),
-                email_data['date'],
-                email_data['body_text'],
-                email_data.get('body_html', ''),
-                email_data['has_attachments'],
-                email_data['attachment_type'],
-                email_data['attachment_count'],
-                email_data.get('attachment_zip_path', ''),
-                links_json,
-                email_data['folder_path'],
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                email_data.get('size_kb', 0)
-            ))
-            
-            self.conn.commit()
-            return self.cursor.lastrowid
+            self._rows_inserted += 1
+            return rowid
         
-        except sqlite3.IntegrityError:
+        except self._writer.integrity_errors:
             print(f"  ⚠ Email already exists in database: {email_data['subject'][:50]}")
             return None
         except Exception as e:
             print(f"  ✗ Database error: {e}")
             return None
     
-    def search_emails(self, query=None, field='all', limit=100):
-        """Search emails in database"""
+    def insert_emails(self, email_data_list, batch_size=500):
+        """Insert many emails with one transaction (and one commit) per batch"""
+        inserted = 0
+        
+        for start in range(0, len(email_data_list), batch_size):
+            batch = email_data_list[start:start + batch_size]
+            # Rows are generated lazily while executemany binds them
+            sql, rows = self._insert_statement(batch)
+            
+            try:
+                with self._transaction():
+                    self._cursor_executemany(sql, rows)
+                    self._cursor_executemany(_SQL_INSERT_BODY, _body_rows(batch))
+                    self._cursor_executemany(
+                        _SQL_INSERT_LINK,
+                        (link for email_data in batch for link in _link_rows(email_data))
+                    )
+                    self._cursor_executemany(_SQL_INSERT_ATTACHMENT_HASH, _attachment_hash_rows(batch))
+                inserted += len(batch)
+                self._rows_inserted += len(batch)
+            except self._writer.integrity_errors:
+                # One duplicate aborts the whole batch - retry row by row so the rest are kept
+                inserted += sum(1 for email_data in batch if self.insert_email(email_data))
+            except Exception as e:
+                print(f"  ✗ Database error: {e}")
+        
+        return inserted
+    
+    def _search_sql(self, query, field, limit, columns):
+        """Pick the SQL and parameters for a search (None if nothing can match)"""
+        select = _select_list(columns)
+        
         if query is None:
             # Return all emails
-            self.cursor.execute('SELECT * FROM emails ORDER BY date DESC LIMIT ?', (limit,))
+            return _SQL_SEARCH_RECENT.format(columns=select), (limit,)
         elif field == 'all':
             # Full-text search
-            self.cursor.execute('''
-                SELECT emails.* FROM emails
-                JOIN emails_fts ON emails.id = emails_fts.rowid
-                WHERE emails_fts MATCH ?
-                ORDER BY emails.date DESC
-                LIMIT ?
-            ''', (query, limit))
-        elif field == 'subject':
-            self.cursor.execute(
-                'SELECT * FROM emails WHERE subject LIKE ? ORDER BY date DESC LIMIT ?',
-                (f'%{query}%', limit)
-            )
-        elif field == 'from':
-            self.cursor.execute(
-                'SELECT * FROM emails WHERE from_address LIKE ? ORDER BY date DESC LIMIT ?',
-                (f'%{query}%', limit)
-            )
+            return _SQL_SEARCH_FTS.format(columns=select), (query, limit)
+        elif field in _FTS_FIELD_COLUMNS:
+            match = _fts_prefix_query(_FTS_FIELD_COLUMNS[field], query)
+            if match is None:
+                return None
+            return _SQL_SEARCH_FTS_RANKED.format(columns=select), (match, limit)
         elif field == 'date':
-            self.cursor.execute(
-                'SELECT * FROM emails WHERE date LIKE ? ORDER BY date DESC LIMIT ?',
-                (f'%{query}%', limit)
-            )
+            pattern = f'%{query}%'
+            return _SQL_SEARCH_DATE.format(columns=select), (pattern, limit)
+        return None
+    
+    def search_emails(self, query=None, field='all', limit=100, columns=None):
+        """Search emails in database (rows are sqlite3.Row; pass columns to select a subset)"""
+        search = self._search_sql(query, field, limit, columns)
+        if search is None:
+            return []
         
-        return self.cursor.fetchall()
+        with self._reader() as conn:
+            return conn.execute(*search).fetchall()
+    
+    def iter_search_emails(self, query=None, field='all', limit=100, columns=None, arraysize=1000):
+        """Like search_emails, but yields rows in chunks instead of building one big list"""
+        search = self._search_sql(query, field, limit, columns)
+        if search is None:
+            return
+        
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.arraysize = arraysize
+            cursor.execute(*search)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                yield from rows
+    
+    def get_email(self, rowid):
+        """Fetch a single email by id, including its HTML body (None if not found)"""
+        with self._reader() as conn:
+            return conn.execute(_SQL_GET_EMAIL, (rowid,)).fetchone()
     
     def get_statistics(self):
         """Get database statistics"""
-        stats = {}
-        
-        # Total emails
-        self.cursor.execute('SELECT COUNT(*) FROM emails')
-        stats['total_emails'] = self.cursor.fetchone()[0]
-        
-        # Emails with attachments
-        self.cursor.execute('SELECT COUNT(*) FROM emails WHERE has_attachments = 1')
-        stats['emails_with_attachments'] = self.cursor.fetchone()[0]
+        # Single read of the trigger-maintained counters
+        with self._reader() as conn:
+            counters = dict(conn.execute(_SQL_STATS).fetchall())
         
-        # Emails with links
-        self.cursor.execute("SELECT COUNT(*) FROM emails WHERE attachment_type IN ('link', 'both')")
-        stats['emails_with_links'] = self.cursor.fetchone()[0]
-        
-        # Total size
-        self.cursor.execute('SELECT SUM(size_kb) FROM emails')
-        total_kb = self.cursor.fetchone()[0] or 0
-        stats['total_size_mb'] = round(total_kb / 1024, 2)
-        
-        # Total attachments
-        self.cursor.execute('SELECT SUM(attachment_count) FROM emails')
-        stats['total_attachments'] = self.cursor.fetchone()[0] or 0
-        
-        return stats
+        return {
+            'total_emails': counters['total_emails'],
+            'emails_with_attachments': counters['emails_with_attachments'],
+            'emails_with_links': counters['emails_with_links'],
+            'total_size_mb': round(counters['total_size_kb'] / 1024, 2),
+            'total_attachments': counters['total_attachments'],
+        }
+    
+    def optimize(self):
+        """Refresh query planner statistics (run after bulk imports)"""
+        self._cursor_execute('ANALYZE emails')
+        self._cursor_execute('ANALYZE emails_fts')
+        self._cursor_execute('PRAGMA optimize')
+        self._rows_inserted = 0
     
     def close(self):
         """Close database connection"""
+        if self.conn and self._rows_inserted > 1000:
+            self.optimize()
+        if self.pool:
+            self.pool.close()
+        if self._writer:
+            self._writer.close()
         if self.conn:
             self.conn.close()
             print("✓ Database connection closed")
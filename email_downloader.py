@@ -6,6 +6,14 @@ import re
 import json
 import configparser
 import logging
+import binascii
+import hashlib
+import functools
+import contextlib
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from database import EmailDatabase
@@ -27,21 +35,60 @@ DOWNLOAD_FOLDER = config.get('DOWNLOAD', 'download_folder')
 # Database
 DB_FILE = config.get('DATABASE', 'database_file')
 
+# Messages per IMAP FETCH command (one round-trip fetches the whole batch)
+FETCH_BATCH_SIZE = 100
+
+# Upper bound for the full messages requested by a single FETCH
+FETCH_BATCH_MAX_MB = 50
+
+# Fetched messages waiting for a worker (bounds the memory held by the fetcher thread)
+FETCH_QUEUE_SIZE = 8
+
+# Threads parsing messages and saving attachments while the next ones are fetched
+PROCESS_WORKERS = 4
+
+# Number of downloaded emails queued before they are written in one transaction
+DB_BATCH_SIZE = config.getint('DATABASE', 'batch_size', fallback=50)
+
+# Runs downloading at least this many emails skip per-row FTS updates and rebuild the index once
+BULK_IMPORT_THRESHOLD = 500
+
 # Security Configuration
 MAX_EMAIL_SIZE_MB = config.getfloat('SECURITY', 'max_email_size_mb', fallback=100.0)
 MAX_ATTACHMENT_SIZE_MB = config.getfloat('SECURITY', 'max_attachment_size_mb', fallback=100.0)
+MAX_EMAIL_SIZE_KB = MAX_EMAIL_SIZE_MB * 1024
+MAX_ATTACHMENT_BYTES = int(MAX_ATTACHMENT_SIZE_MB * 1024 * 1024)
 BLOCK_EXECUTABLE_FILES = config.getboolean('SECURITY', 'block_executable_files', fallback=True)
 SKIP_SUSPICIOUS_EMAILS = config.getboolean('SECURITY', 'skip_suspicious_emails', fallback=True)
 
 # Blacklist senders (comma-separated in config)
 BLACKLIST_SENDERS = [s.strip() for s in config.get('SECURITY', 'blacklist_senders', fallback='').split(',') if s.strip()]
+BLACKLIST_SENDERS_LOWER = tuple(s.lower() for s in BLACKLIST_SENDERS)
 
-# Executable file extensions to block
-EXECUTABLE_EXTENSIONS = [
+# Executable file extensions to block (a tuple, so str.endswith can check them all at once)
+EXECUTABLE_EXTENSIONS = (
     '.exe', '.bat', '.cmd', '.com', '.scr', '.pif', '.msi', '.vbs', 
     '.js', '.jse', '.wsf', '.wsh', '.ps1', '.app', '.deb', '.rpm',
     '.jar', '.apk', '.dmg', '.pkg', '.run', '.bin','.tbz'
-]
+)
+
+# Attachments with these extensions / content types are real files, never link files
+FILE_EXTENSIONS = (
+    '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.pdf', '.txt', '.zip', '.rar', '.7z',
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp',
+    '.mp3', '.mp4', '.avi', '.mov',
+    '.exe', '.msi', '.apk'
+)
+FILE_CONTENT_TYPES = (
+    'application/msword',
+    'application/vnd.openxmlformats',
+    'application/pdf',
+    'application/zip',
+    'image/',
+    'video/',
+    'audio/'
+)
 
 # Suspicious patterns in email
 SUSPICIOUS_PATTERNS = [
@@ -49,6 +96,45 @@ SUSPICIOUS_PATTERNS = [
     'congratulations', 'you won', 'claim your prize', 'act now'
 ]
 
+# Suspicious patterns compiled into one regex so a single scan checks every entry
+# (longest first, so a pattern is never shadowed by a shorter one it starts with)
+SUSPICIOUS_RE = re.compile(
+    '|'.join(map(re.escape, sorted(SUSPICIOUS_PATTERNS, key=len, reverse=True))),
+    re.IGNORECASE
+)
+
+# URLs in bodies and link attachments. One character class keeps the scan linear;
+# [!$-_a-z] is the same set as the old (?:[a-zA-Z]|[0-9]|[$-_@.&+]|...)+ alternation
+URL_RE = re.compile(r'https?://[!$-_a-z]+')
+URL_BYTES_RE = re.compile(rb'https?://[!$-_a-z]+')
+
+# Body links are only looked for in the first 256KB of each body
+MAX_BODY_SCAN = 256 * 1024
+
+# Any URL-looking token in a (small) attachment, used to spot link files
+URL_TOKEN_BYTES_RE = re.compile(rb'https?://\S+')
+
+# Cloud storage link types; the group that matched names the type
+LINK_TYPE_RE = re.compile(
+    r'(?P<google_drive>drive\.google\.com|docs\.google\.com)'
+    r'|(?P<dropbox>dropbox\.com)'
+    r'|(?P<onedrive>onedrive|sharepoint)'
+    r'|(?P<box>box\.com)',
+    re.IGNORECASE
+)
+
+# Pieces of imaplib FETCH responses: message number at the start of a response
+# (with or without a literal following it) and the RFC822.SIZE item
+FETCH_LITERAL_ID_RE = re.compile(rb'\s*(\d+)')
+FETCH_RESPONSE_ID_RE = re.compile(rb'(\d+) \(')
+FETCH_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+
+# Base64 attachments whose encoded payload is at least this big are decoded straight
+# into their file, one chunk at a time (far above the 10KB a link file can have)
+STREAM_DECODE_MIN_BYTES = 64 * 1024
+STREAM_DECODE_CHUNK = 1024 * 1024
+BASE64_JUNK_RE = re.compile(r'[^A-Za-z0-9+/=]')
+
 # Logging
 if config.getboolean('LOGGING', 'enable_logging'):
     logging.basicConfig(
@@ -69,6 +155,13 @@ def decode_str(s):
     if isinstance(s, bytes):
         s = s.decode('utf-8', errors='ignore')
     
+    if isinstance(s, str):
+        return decode_header_cached(s)
+    # e.g. email.header.Header objects (not hashable, so not cached)
+    return decode_header_parts(s)
+
+def decode_header_parts(s):
+    """Decode an RFC 2047 encoded header into one string"""
     decoded_parts = decode_header(s)
     decoded_string = ""
     
@@ -86,15 +179,15 @@ def decode_str(s):
     
     return decoded_string
 
+# The same senders and recipients repeat across a mailbox; decoding is pure, so memoize it
+decode_header_cached = functools.lru_cache(maxsize=4096)(decode_header_parts)
+
+# Line breaks dropped, tabs to spaces, characters invalid in filenames to '_'
+FILENAME_TRANS = str.maketrans({'\r': None, '\n': None, '\t': ' ', **dict.fromkeys('<>:"/\\|?*', '_')})
+
 def clean_filename(filename):
     """Clean filename from invalid characters"""
-    filename = filename.replace('\r', '').replace('\n', '').replace('\t', ' ')
-    
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
-    
-    filename = filename.strip(' .')
+    filename = filename.translate(FILENAME_TRANS).strip(' .')
     
     if len(filename) > 200:
         name, ext = os.path.splitext(filename)
@@ -111,268 +204,506 @@ def is_sender_blacklisted(from_addr):
         return False
     
     from_addr_lower = from_addr.lower()
-    for blocked in BLACKLIST_SENDERS:
-        if blocked.lower() in from_addr_lower:
-            return True
-    return False
+    return any(blocked in from_addr_lower for blocked in BLACKLIST_SENDERS_LOWER)
 
 def is_executable_file(filename):
     """Check if file is executable based on extension"""
     if not filename:
         return False
     
-    filename_lower = filename.lower()
-    for ext in EXECUTABLE_EXTENSIONS:
-        if filename_lower.endswith(ext):
-            return True
-    return False
+    return filename.lower().endswith(EXECUTABLE_EXTENSIONS)
 
 def check_suspicious_content(subject, body_text):
     """Check if email contains suspicious patterns"""
     content = (subject + " " + body_text).lower()
-    suspicious_found = []
-    
-    for pattern in SUSPICIOUS_PATTERNS:
-        if pattern in content:
-            suspicious_found.append(pattern)
+    found = set(SUSPICIOUS_RE.findall(content))
     
-    return suspicious_found
+    # Report in SUSPICIOUS_PATTERNS order, like the per-pattern loop did
+    return [pattern for pattern in SUSPICIOUS_PATTERNS if pattern in found]
 
-def get_email_size_kb(mail, email_id):
-    """Get email size before full download"""
-    try:
-        status, data = mail.fetch(email_id, '(RFC822.SIZE)')
-        if status == 'OK':
-            size_match = re.search(r'RFC822.SIZE (\d+)', data[0].decode('utf-8', errors='ignore'))
-            if size_match:
-                size_bytes = int(size_match.group(1))
-                return round(size_bytes / 1024, 2)
-    except Exception as e:
-        logging.error(f"Error getting email size: {e}")
-    return 0
-
-def is_email_safe(mail, email_id, index):
-    """Comprehensive security check before downloading"""
+def is_email_safe(size_kb, header_msg):
+    """
+    Comprehensive security check before downloading (size and headers are prefetched).
+    Returns (is_safe, reasons, subject, from_addr) so callers can log without decoding again
+    """
     reasons = []
+    subject = "Unknown"
+    from_addr = "Unknown"
     
     # 1. Check email size
-    size_kb = get_email_size_kb(mail, email_id)
-    max_size_kb = MAX_EMAIL_SIZE_MB * 1024
+    if size_kb > MAX_EMAIL_SIZE_KB:
+        reasons.append(f"Size too large ({size_kb} KB > {MAX_EMAIL_SIZE_KB} KB)")
     
-    if size_kb > max_size_kb:
-        reasons.append(f"Size too large ({size_kb} KB > {max_size_kb} KB)")
+    # 2. Check headers
+    if header_msg is None:
+        reasons.append(f"Error reading email headers")
+        return False, reasons, subject, from_addr
     
-    # 2. Fetch headers only for quick check
     try:
-        status, header_data = mail.fetch(email_id, '(BODY[HEADER.FIELDS (FROM SUBJECT)])')
-        if status == 'OK':
-            header_msg = email.message_from_bytes(header_data[0][1])
-            from_addr = decode_str(header_msg.get('From', ''))
-            subject = decode_str(header_msg.get('Subject', ''))
-            
-            # Check blacklist
-            if is_sender_blacklisted(from_addr):
-                reasons.append(f"Sender in blacklist: {from_addr}")
-            
-            # Check suspicious patterns in subject
-            if SKIP_SUSPICIOUS_EMAILS:
-                suspicious = check_suspicious_content(subject, "")
-                if suspicious:
-                    reasons.append(f"Suspicious patterns: {', '.join(suspicious)}")
+        from_addr = decode_str(header_msg.get('From', ''))
+        subject = decode_str(header_msg.get('Subject', ''))
+        
+        # Check blacklist
+        if is_sender_blacklisted(from_addr):
+            reasons.append(f"Sender in blacklist: {from_addr}")
+        
+        # Check suspicious patterns in subject
+        if SKIP_SUSPICIOUS_EMAILS:
+            suspicious = check_suspicious_content(subject, "")
+            if suspicious:
+                reasons.append(f"Suspicious patterns: {', '.join(suspicious)}")
     except Exception as e:
         logging.error(f"Error checking email safety: {e}")
         reasons.append(f"Error reading email headers")
     
-    return len(reasons) == 0, reasons, size_kb
+    return len(reasons) == 0, reasons, subject, from_addr
+
+# Shared IMAP connection, opened by get_mail_client() and reused for the whole run
+# (only one thread at a time may use it - imaplib isn't thread-safe)
+mail_client = None
+
+def get_mail_client(reconnect=False):
+    """Logged-in IMAP connection with INBOX selected; reconnect=True replaces a dropped one"""
+    global mail_client
+    if mail_client is not None and not reconnect:
+        return mail_client
+    
+    if mail_client is not None:
+        with contextlib.suppress(Exception):
+            mail_client.shutdown()
+        mail_client = None
+    
+    if USE_SSL:
+        mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+    else:
+        mail = imaplib.IMAP4(IMAP_SERVER, IMAP_PORT)
+    mail.login(EMAIL_ACCOUNT, PASSWORD)
+    mail.select('INBOX')
+    mail_client = mail
+    return mail
+
+def close_mail_client():
+    """Close the mailbox and log out of the shared IMAP connection"""
+    global mail_client
+    if mail_client is None:
+        return
+    try:
+        mail_client.close()
+        mail_client.logout()
+    finally:
+        mail_client = None
+
+def imap_fetch(message_set, items):
+    """FETCH on the shared connection, reconnecting once if the server dropped it"""
+    try:
+        return get_mail_client().fetch(message_set, items)
+    except (imaplib.IMAP4.abort, OSError) as e:
+        print(f"⚠ IMAP connection lost ({e}) - reconnecting...")
+        logging.warning(f"IMAP connection lost, reconnecting: {e}")
+        return get_mail_client(reconnect=True).fetch(message_set, items)
+
+def build_sequence_set(email_ids):
+    """Compact IMAP sequence set for message numbers, e.g. [b'1', b'2', b'3', b'7'] -> '1:3,7'"""
+    numbers = sorted({int(email_id) for email_id in email_ids})
+    ranges = []
+    start = end = numbers[0]
+    for number in numbers[1:]:
+        if number == end + 1:
+            end = number
+            continue
+        ranges.append(f"{start}:{end}" if start != end else str(start))
+        start = end = number
+    ranges.append(f"{start}:{end}" if start != end else str(start))
+    return ','.join(ranges)
+
+def parse_fetch_response(data):
+    """
+    Group an imaplib FETCH response by message number.
+    Returns {email_id: (response text, literal bytes or None)}
+    """
+    results = {}
+    current = None
+    
+    for item in data:
+        if isinstance(item, tuple):
+            # (b'12 (RFC822.SIZE 3456 BODY[...] {78}', b'<literal>')
+            head, literal = item
+            email_id = FETCH_LITERAL_ID_RE.match(head).group(1)
+            text, _ = results.get(email_id, (b'', None))
+            results[email_id] = (text + head, literal)
+            current = email_id
+        elif isinstance(item, bytes):
+            match = FETCH_RESPONSE_ID_RE.match(item)
+            if match:
+                # Message without a literal, e.g. b'12 (RFC822.SIZE 3456)'
+                current = match.group(1)
+                text, literal = results.get(current, (b'', None))
+                results[current] = (text + item, literal)
+            elif current is not None:
+                # Rest of the previous message after its literal, e.g. b' RFC822.SIZE 3456)'
+                text, literal = results[current]
+                results[current] = (text + item, literal)
+    
+    return results
+
+def fetch_emails_bulk(id_list, batch=FETCH_BATCH_SIZE):
+    """
+    Fetch emails in batches instead of one round-trip per message:
+      - one FETCH for the size and From/Subject headers of the whole batch
+      - one FETCH (split at FETCH_BATCH_MAX_MB) for the full messages that pass is_email_safe
+    Yields (email_id, (size_kb, safety, raw_bytes)) in id_list order, where safety is
+    the is_email_safe() result; raw_bytes is None when the message was not downloaded
+    """
+    max_batch_kb = FETCH_BATCH_MAX_MB * 1024
+    
+    for start in range(0, len(id_list), batch):
+        chunk = id_list[start:start + batch]
+        sizes = dict.fromkeys(chunk, 0)
+        headers = dict.fromkeys(chunk)
+        raw_emails = dict.fromkeys(chunk)
+        
+        # Sizes and headers (PEEK: don't mark messages as read that may be skipped)
+        try:
+            status, data = imap_fetch(build_sequence_set(chunk), '(RFC822.SIZE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)])')
+            if status == 'OK':
+                for email_id, (text, literal) in parse_fetch_response(data).items():
+                    if email_id not in sizes:
+                        continue
+                    size_match = FETCH_SIZE_RE.search(text)
+                    if size_match:
+                        sizes[email_id] = round(int(size_match.group(1)) / 1024, 2)
+                    if literal is not None:
+                        headers[email_id] = email.message_from_bytes(literal)
+        except Exception as e:
+            print(f"✗ Error fetching email headers: {e}")
+            logging.error(f"Error fetching headers for {len(chunk)} email(s): {e}")
+        
+        # Full messages, only for the safe ones and in size-bounded groups
+        safety = {email_id: is_email_safe(sizes[email_id], headers[email_id]) for email_id in chunk}
+        groups = []
+        group_kb = 0
+        for email_id in chunk:
+            if not safety[email_id][0]:
+                continue
+            if not groups or group_kb + sizes[email_id] > max_batch_kb:
+                groups.append([])
+                group_kb = 0
+            groups[-1].append(email_id)
+            group_kb += sizes[email_id]
+        
+        for group in groups:
+            try:
+                status, data = imap_fetch(build_sequence_set(group), '(RFC822)')
+                if status == 'OK':
+                    for email_id, (_, literal) in parse_fetch_response(data).items():
+                        if email_id in raw_emails:
+                            raw_emails[email_id] = literal
+            except Exception as e:
+                print(f"✗ Error fetching {len(group)} email(s): {e}")
+                logging.error(f"Error fetching {len(group)} email(s): {e}")
+        
+        for email_id in chunk:
+            yield email_id, (sizes[email_id], safety[email_id], raw_emails[email_id])
 
 def extract_links(text):
-    """Extract URLs from text"""
+    """Extract unique URLs from text (str, or raw bytes to skip decoding)"""
     if not text:
         return []
     
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    urls = re.findall(url_pattern, text)
-    return list(set(urls))
+    if isinstance(text, bytes):
+        urls = (url.decode('ascii') for url in URL_BYTES_RE.findall(text))
+    else:
+        urls = URL_RE.findall(text)
+    return list(dict.fromkeys(urls))
 
 def identify_link_type(url):
     """Identify the type of cloud storage link"""
-    url_lower = url.lower()
-    
-    if 'drive.google.com' in url_lower or 'docs.google.com' in url_lower:
-        return 'google_drive'
-    elif 'dropbox.com' in url_lower:
-        return 'dropbox'
-    elif 'onedrive' in url_lower or 'sharepoint' in url_lower:
-        return 'onedrive'
-    elif 'box.com' in url_lower:
-        return 'box'
-    else:
-        return 'other'
+    m = LINK_TYPE_RE.search(url)
+    return m.lastgroup if m else 'other'
 
-def is_attachment_link(part):
-    """Check if attachment is actually a link/URL file"""
-    filename = part.get_filename()
+def is_attachment_link(filename, content_type, content):
+    """Check if attachment is actually a link/URL file (content is the decoded payload)"""
     if not filename:
         return False
     
-    content_type = part.get_content_type()
-    
     # Known file extensions that are actual files, not links
-    file_extensions = [
-        '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
-        '.pdf', '.txt', '.zip', '.rar', '.7z',
-        '.jpg', '.jpeg', '.png', '.gif', '.bmp',
-        '.mp3', '.mp4', '.avi', '.mov',
-        '.exe', '.msi', '.apk'
-    ]
-    
-    filename_lower = filename.lower()
-    for ext in file_extensions:
-        if filename_lower.endswith(ext):
-            return False
+    if filename.lower().endswith(FILE_EXTENSIONS):
+        return False
     
     # Check if filename contains URL
     if re.search(r'https?://', filename):
         return True
     
     # Check content type
-    known_file_types = [
-        'application/msword',
-        'application/vnd.openxmlformats',
-        'application/pdf',
-        'application/zip',
-        'image/',
-        'video/',
-        'audio/'
-    ]
-    
-    for file_type in known_file_types:
-        if content_type.startswith(file_type):
-            return False
+    if content_type.startswith(FILE_CONTENT_TYPES):
+        return False
     
     # Check content
-    try:
-        content = part.get_payload(decode=True)
-        if content and isinstance(content, bytes):
-            if len(content) > 10240:  # If larger than 10KB, likely a real file
-                return False
-            
-            content_str = content.decode('utf-8', errors='ignore')
-            urls = re.findall(r'https?://[^\s]+', content_str)
-            if urls:
-                total_url_length = sum(len(url) for url in urls)
-                if total_url_length > len(content_str) * 0.5:
-                    return True
-    except:
-        pass
+    if content and isinstance(content, bytes):
+        if len(content) > 10240:  # If larger than 10KB, likely a real file
+            return False
+        
+        urls = URL_TOKEN_BYTES_RE.findall(content)
+        if urls:
+            total_url_length = sum(map(len, urls))
+            if total_url_length > len(content) * 0.5:
+                return True
     
     return False
 
-def process_attachments(msg, email_folder):
-    """Process email attachments - OPTIMIZED: Direct download without ZIP"""
+def iter_base64_chunks(encoded, chunk_size=STREAM_DECODE_CHUNK):
+    """Decode a base64 payload string piece by piece (yields bytes)"""
+    carry = ''
+    for start in range(0, len(encoded), chunk_size):
+        data = carry + BASE64_JUNK_RE.sub('', encoded[start:start + chunk_size])
+        usable = len(data) - len(data) % 4
+        carry = data[usable:]
+        if usable:
+            yield binascii.a2b_base64(data[:usable])
+    
+    # Tolerate missing padding at the end, like get_payload(decode=True) does
+    if len(carry) > 1:
+        yield binascii.a2b_base64(carry + '=' * (-len(carry) % 4))
+
+def write_base64_payload(encoded, f, max_bytes, digest=None):
+    """
+    Stream-decode a base64 payload into the open file f without holding it decoded in memory
+    (digest, a hashlib object, is fed the decoded bytes on the way).
+    Returns the number of bytes written, or None as soon as it would exceed max_bytes
+    """
+    written = 0
+    for chunk in iter_base64_chunks(encoded):
+        written += len(chunk)
+        if written > max_bytes:
+            return None
+        f.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+    return written
+
+def create_unique_file(folder, name):
+    """
+    Atomically create a new file in folder (O_EXCL: never reuses an existing one),
+    adding _1, _2... to the name while it is taken. Returns (binary file object, name)
+    """
+    base_name, ext = os.path.splitext(name)
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    candidate = name
+    counter = 1
+    while True:
+        try:
+            fd = os.open(os.path.join(folder, candidate), flags, 0o644)
+            return os.fdopen(fd, 'wb'), candidate
+        except FileExistsError:
+            candidate = f"{base_name}_{counter}{ext}"
+            counter += 1
+
+# sha1 -> path of every attachment saved so far, shared by the worker threads
+# (main() seeds it from the database, so duplicates are found across runs too)
+known_attachments = {}
+known_attachments_lock = threading.Lock()
+
+def claim_attachment(sha1, filepath):
+    """Record filepath as the saved copy of this content, or return the earlier copy's path"""
+    with known_attachments_lock:
+        existing = known_attachments.get(sha1)
+        if existing and os.path.exists(existing):
+            return existing
+        known_attachments[sha1] = filepath
+        return None
+
+def link_attachment(existing, filepath):
+    """Make filepath a hard link to an identical saved attachment (False if that's not possible)"""
+    temp_path = filepath + '.link'
+    try:
+        os.link(existing, temp_path)
+        os.replace(temp_path, filepath)
+        return True
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        return False
+
+def process_parts(msg, email_folder, log=print):
+    """
+    Walk the MIME tree ONCE: pick the text/HTML body and save attachments as they are visited.
+    Each part's headers are read once and its payload is decoded at most once
+    (large base64 attachments are decoded straight into their file).
+    Attachments identical to one saved before (same sha1) are hard-linked, not rewritten.
+    Progress lines go to log (print by default).
+    Returns (body_text, body_html, attachment_files, attachment_links, blocked_files,
+             attachment_hashes) - attachment_hashes lists (sha1, path) of newly saved files
+    """
+    body_text = ""
+    body_html = ""
     attachment_files = []
     attachment_links = []
     blocked_files = []
+    attachment_hashes = []
     processed_parts = set()  # Track processed parts to avoid duplicates
-    
-    max_attachment_bytes = MAX_ATTACHMENT_SIZE_MB * 1024 * 1024
+    folder_created = False  # email_folder is only created for the first saved file
     
     for part in msg.walk():
         # Skip multipart containers
-        if part.get_content_maintype() == 'multipart':
+        if part.is_multipart():
             continue
         
-        # Skip if no Content-Disposition (not an attachment)
-        if part.get('Content-Disposition') is None:
+        content_type = part.get_content_type()
+        wants_text = content_type == "text/plain" and not body_text
+        wants_html = content_type == "text/html" and not body_html
+        
+        # Attachments need a Content-Disposition and a filename
+        filename = part.get_filename() if part.get('Content-Disposition') is not None else None
+        if not (wants_text or wants_html or filename):
             continue
         
-        filename = part.get_filename()
+        # Transfer-encoded payload of attachments (usually the stored string itself, not a copy)
+        raw_payload = str(part.get_payload()) if filename else ''
+        
+        # Large base64 attachments are left encoded here and streamed to disk below
+        encoded = None
+        if filename and not (wants_text or wants_html) and len(raw_payload) >= STREAM_DECODE_MIN_BYTES:
+            if str(part.get('Content-Transfer-Encoding', '')).strip().lower() == 'base64':
+                encoded = raw_payload
+        
+        # Body parts are decoded right away; attachments only once they pass the checks below
+        content = None
+        if wants_text or wants_html:
+            with contextlib.suppress(Exception):
+                content = part.get_payload(decode=True)
+        
+        # Email body (for database only, NOT saved to files)
+        if content and wants_text:
+            body_text = content.decode('utf-8', errors='ignore')
+        elif content and wants_html:
+            body_html = content.decode('utf-8', errors='ignore')
+        
         if not filename:
             continue
             
         filename = decode_str(filename)
         
-        # Create unique identifier to prevent duplicate processing
-        part_id = f"{filename}_{part.get_content_type()}_{len(part.get_payload(decode=False))}"
+        # Create unique identifier to prevent duplicate processing: name, type, encoded
+        # length and a short digest of the payload's first/last 256 characters
+        edges = (raw_payload[:256] + raw_payload[-256:]).encode('utf-8', 'surrogateescape')
+        part_id = (filename, content_type, len(raw_payload), hashlib.blake2b(edges, digest_size=8).digest())
         if part_id in processed_parts:
-            print(f"  ⚠️  Skipping duplicate: {filename}")
+            log(f"  ⚠️  Skipping duplicate: {filename}")
             continue
         processed_parts.add(part_id)
         
         # Security check: Block executable files
         if BLOCK_EXECUTABLE_FILES and is_executable_file(filename):
             blocked_files.append(filename)
-            print(f"  🚫 BLOCKED executable file: {filename}")
+            log(f"  🚫 BLOCKED executable file: {filename}")
             logging.warning(f"Blocked executable file: {filename}")
             continue
         
+        # Decode the kept attachment (large base64 ones are streamed to disk instead)
+        if content is None and encoded is None:
+            with contextlib.suppress(Exception):
+                content = part.get_payload(decode=True)
+        
         # Check if this is a link attachment
-        if is_attachment_link(part):
+        if is_attachment_link(filename, content_type, content):
             try:
-                content = part.get_payload(decode=True)
+                if content is None and encoded is not None:
+                    content = part.get_payload(decode=True)
                 if content:
-                    content_str = content.decode('utf-8', errors='ignore')
-                    urls = extract_links(content_str)
+                    urls = extract_links(content)
                     for url in urls:
                         attachment_links.append({
                             'url': url,
                             'filename': clean_filename(filename),
                             'type': identify_link_type(url)
                         })
-                    print(f"  🔗 Link attachment found: {filename}")
+                    log(f"  🔗 Link attachment found: {filename}")
             except Exception as e:
                 logging.error(f"Error extracting link from attachment: {e}")
         else:
             # Regular file attachment - DIRECT DOWNLOAD WITHOUT ZIP
             try:
-                content = part.get_payload(decode=True)
-                
-                if not content:
-                    print(f"  ⚠️  Empty content: {filename}")
+                if encoded is None and not content:
+                    log(f"  ⚠️  Empty content: {filename}")
                     continue
                 
-                # Check attachment size
-                file_size_mb = len(content) / 1024 / 1024
-                if len(content) > max_attachment_bytes:
+                # Check attachment size (streamed ones are checked while writing)
+                if content and len(content) > MAX_ATTACHMENT_BYTES:
+                    file_size_mb = len(content) / 1024 / 1024
                     blocked_files.append(f"{filename} (size: {file_size_mb:.2f} MB)")
-                    print(f"  🚫 BLOCKED large file: {filename} ({file_size_mb:.2f} MB)")
+                    log(f"  🚫 BLOCKED large file: {filename} ({file_size_mb:.2f} MB)")
                     logging.warning(f"Blocked large file: {filename}")
                     continue
                 
-                # Clean filename and save directly
-                clean_name = clean_filename(filename)
+                if not folder_created:
+                    Path(email_folder).mkdir(parents=True, exist_ok=True)
+                    folder_created = True
+                
+                # Clean filename and create the file (atomically - never overwrites an existing one)
+                f, clean_name = create_unique_file(email_folder, clean_filename(filename))
                 filepath = os.path.join(email_folder, clean_name)
                 
-                # Prevent overwriting if file exists
-                counter = 1
-                base_name, ext = os.path.splitext(clean_name)
-                while os.path.exists(filepath):
-                    clean_name = f"{base_name}_{counter}{ext}"
-                    filepath = os.path.join(email_folder, clean_name)
-                    counter += 1
+                # Write file ONCE - or link it to an identical attachment saved earlier
+                with f:
+                    if encoded is not None:
+                        # Streamed: the hash is only known once written, so a duplicate is linked afterwards
+                        sha1 = hashlib.sha1()
+                        written = write_base64_payload(encoded, f, MAX_ATTACHMENT_BYTES, sha1)
+                        sha1 = sha1.hexdigest()
+                        existing = None
+                    else:
+                        sha1 = hashlib.sha1(content).hexdigest()
+                        written = len(content)
+                        existing = claim_attachment(sha1, filepath)
+                        if existing is None:
+                            f.write(content)
                 
-                # Write file ONCE
-                with open(filepath, 'wb') as f:
-                    f.write(content)
+                if written is None:
+                    os.remove(filepath)
+                    if not attachment_files:
+                        with contextlib.suppress(OSError):
+                            os.rmdir(email_folder)
+                        folder_created = False
+                    blocked_files.append(f"{filename} (size: > {MAX_ATTACHMENT_SIZE_MB:.2f} MB)")
+                    log(f"  🚫 BLOCKED large file: {filename} (> {MAX_ATTACHMENT_SIZE_MB:.2f} MB)")
+                    logging.warning(f"Blocked large file: {filename}")
+                    continue
                 
+                if encoded is not None:
+                    existing = claim_attachment(sha1, filepath)
+                if existing and not link_attachment(existing, filepath):
+                    existing = None
+                    if encoded is None:
+                        # Linking failed - fill the empty placeholder after all
+                        with open(filepath, 'wb') as f:
+                            f.write(content)
+                
+                file_size_mb = written / 1024 / 1024
                 attachment_files.append(clean_name)
-                print(f"  📎 Attachment saved: {clean_name} ({file_size_mb:.2f} MB)")
+                if existing:
+                    log(f"  📎 Attachment linked: {clean_name} ({file_size_mb:.2f} MB, same as {existing})")
+                else:
+                    attachment_hashes.append((sha1, filepath))
+                    log(f"  📎 Attachment saved: {clean_name} ({file_size_mb:.2f} MB)")
                 
             except Exception as e:
                 logging.error(f"Error saving attachment {filename}: {e}")
-                print(f"  ❌ Error saving {filename}: {e}")
+                log(f"  ❌ Error saving {filename}: {e}")
     
     if blocked_files:
-        print(f"  ⚠️  Total blocked files: {len(blocked_files)}")
+        log(f"  ⚠️  Total blocked files: {len(blocked_files)}")
     
-    return attachment_files, attachment_links, blocked_files
+    return body_text, body_html, attachment_files, attachment_links, blocked_files, attachment_hashes
+
+# Worker threads append to the same suspicious_emails.txt
+suspicious_log_lock = threading.Lock()
 
 def log_suspicious_email(subject, from_addr, reasons, size_kb, index):
     """Log suspicious email to a text file"""
     log_file = os.path.join(DOWNLOAD_FOLDER, "suspicious_emails.txt")
     
     try:
-        with open(log_file, 'a', encoding='utf-8') as f:
+        with suspicious_log_lock, open(log_file, 'a', encoding='utf-8') as f:
             f.write(f"\n{'='*70}\n")
             f.write(f"Email #{index} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write(f"Subject: {subject}\n")
@@ -385,58 +716,39 @@ def log_suspicious_email(subject, from_addr, reasons, size_kb, index):
     except Exception as e:
         logging.error(f"Error logging suspicious email: {e}")
 
-def download_email(email_id, mail, index, db):
-    """Download a specific email - OPTIMIZED: Only save attachments to disk"""
-    
-    # Check if email already exists in database
+def process_downloaded_email(email_id, fetched, index, log=print):
+    """
+    Process an email prefetched by fetch_emails_bulk - OPTIMIZED: Only save attachments to disk
+    Progress lines go to log (print by default)
+    """
     email_id_str = email_id.decode('utf-8')
-    if db.email_exists(email_id_str):
-        print(f"\n⏭  Email #{index} already exists in database - skipping")
-        return False, 'exists'
+    size_kb, safety, raw_email = fetched
     
-    # Security check before downloading
-    is_safe, reasons, size_kb = is_email_safe(mail, email_id, index)
+    # Security check result from before downloading
+    is_safe, reasons, subject, from_addr = safety
     
     if not is_safe:
-        # Fetch basic info for logging
-        try:
-            status, header_data = mail.fetch(email_id, '(BODY[HEADER.FIELDS (FROM SUBJECT)])')
-            if status == 'OK':
-                header_msg = email.message_from_bytes(header_data[0][1])
-                from_addr = decode_str(header_msg.get('From', ''))
-                subject = decode_str(header_msg.get('Subject', ''))
-        except:
-            from_addr = "Unknown"
-            subject = "Unknown"
-        
-        print(f"\n🚫 Email #{index} SKIPPED (suspicious)")
-        print(f"   Subject: {subject[:60]}...")
-        print(f"   From: {from_addr}")
-        print(f"   Reasons: {', '.join(reasons)}")
+        log(f"\n🚫 Email #{index} SKIPPED (suspicious)")
+        log(f"   Subject: {subject[:60]}...")
+        log(f"   From: {from_addr}")
+        log(f"   Reasons: {', '.join(reasons)}")
         
         log_suspicious_email(subject, from_addr, reasons, size_kb, index)
         logging.info(f"Skipped suspicious email #{index}: {reasons}")
-        return False, 'skipped'
+        return None, 'skipped'
     
-    # Fetch email ONCE
-    try:
-        status, data = mail.fetch(email_id, '(RFC822)')
-    except Exception as e:
-        print(f"✗ Error fetching email {index}: {e}")
-        logging.error(f"Error fetching email {index}: {e}")
-        return False, 'error'
-    
-    if status != 'OK' or not data or not data[0]:
-        print(f"✗ Invalid response for email {index}")
-        return False, 'error'
+    # Full message comes from the batched FETCH
+    if not raw_email:
+        log(f"✗ Invalid response for email {index}")
+        return None, 'error'
     
     # Parse email ONCE
     try:
-        msg = email.message_from_bytes(data[0][1])
+        msg = email.message_from_bytes(raw_email)
     except Exception as e:
-        print(f"✗ Error parsing email {index}: {e}")
+        log(f"✗ Error parsing email {index}: {e}")
         logging.error(f"Error parsing email {index}: {e}")
-        return False, 'error'
+        return None, 'error'
     
     # Extract email information
     subject = decode_str(msg.get('Subject', 'No Subject'))
@@ -445,66 +757,33 @@ def download_email(email_id, mail, index, db):
     cc_addr = decode_str(msg.get('Cc', ''))
     date = msg.get('Date', '')
     
-    print(f"\n{'='*70}")
-    print(f"Email #{index}")
-    print(f"Subject: {subject}")
-    print(f"From: {from_addr}")
-    print(f"Date: {date}")
-    print(f"Size: {size_kb} KB")
-    print(f"{'='*70}")
+    log(f"\n{'='*70}")
+    log(f"Email #{index}")
+    log(f"Subject: {subject}")
+    log(f"From: {from_addr}")
+    log(f"Date: {date}")
+    log(f"Size: {size_kb} KB")
+    log(f"{'='*70}")
     
-    # Create folder for this email (only if it has attachments)
+    # Folder for this email (created only once an attachment is saved)
     folder_name = f"email_{index}_{clean_filename(subject[:50])}"
     email_folder = os.path.join(DOWNLOAD_FOLDER, folder_name)
     
-    # Extract email body (for database only, NOT saved to files)
-    body_text = ""
-    body_html = ""
-    
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            if content_type == "text/plain" and not body_text:
-                try:
-                    body_text = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                except:
-                    pass
-            elif content_type == "text/html" and not body_html:
-                try:
-                    body_html = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                except:
-                    pass
-    else:
-        try:
-            content_type = msg.get_content_type()
-            payload = msg.get_payload(decode=True)
-            if payload:
-                payload_str = payload.decode('utf-8', errors='ignore')
-                if content_type == "text/plain":
-                    body_text = payload_str
-                elif content_type == "text/html":
-                    body_html = payload_str
-        except:
-            body_text = str(msg.get_payload())
-    
-    print(f"  ✓ Email body extracted")
+    # One pass over the MIME parts: body (for database only, NOT saved to files) and
+    # attachments (ONLY DOWNLOAD ATTACHMENTS - NO ZIP, NO EXTRA FILES)
+    (body_text, body_html, attachment_files, attachment_links,
+     blocked_files, attachment_hashes) = process_parts(msg, email_folder, log)
     
-    # Extract links from body
-    body_links = extract_links(body_text) + extract_links(body_html)
+    log(f"  ✓ Email body extracted")
     
-    # Create folder only if needed (for attachments)
-    Path(email_folder).mkdir(parents=True, exist_ok=True)
+    # Extract links from body (one scan over the start of both bodies)
+    body_links = extract_links(body_text[:MAX_BODY_SCAN] + '\n' + body_html[:MAX_BODY_SCAN])
     
-    # Process attachments (ONLY DOWNLOAD ATTACHMENTS - NO ZIP, NO EXTRA FILES)
-    attachment_files, attachment_links, blocked_files = process_attachments(msg, email_folder)
-    
-    # If no attachments, remove the empty folder
-    if not attachment_files and not attachment_links:
-        try:
-            os.rmdir(email_folder)
-            email_folder = ""  # No folder created
-        except:
-            pass
+    # No saved files: link-only emails still get their (empty) folder, as before
+    if attachment_links and not attachment_files:
+        Path(email_folder).mkdir(parents=True, exist_ok=True)
+    elif not attachment_files:
+        email_folder = ""  # No folder created
     
     # Determine attachment type
     has_files = len(attachment_files) > 0
@@ -529,13 +808,13 @@ def download_email(email_id, mail, index, db):
     # Display summary
     total_attachments = len(attachment_files) + len(attachment_links)
     if total_attachments > 0:
-        print(f"  📊 Attachments summary:")
+        log(f"  📊 Attachments summary:")
         if attachment_files:
-            print(f"     - Files: {len(attachment_files)} (saved directly)")
+            log(f"     - Files: {len(attachment_files)} (saved directly)")
         if attachment_links:
-            print(f"     - Links: {len(attachment_links)}")
+            log(f"     - Links: {len(attachment_links)}")
     else:
-        print(f"  ℹ  No attachments")
+        log(f"  ℹ  No attachments")
     
     # Prepare data for database
     email_data = {
@@ -553,25 +832,104 @@ def download_email(email_id, mail, index, db):
         'attachment_zip_path': '',  # No ZIP anymore
         'links': links_data,
         'folder_path': os.path.relpath(email_folder) if email_folder else '',
-        'size_kb': size_kb
+        'size_kb': size_kb,
+        'attachment_hashes': attachment_hashes
     }
     
-    # Insert into database
-    try:
-        db_id = db.insert_email(email_data)
-        if db_id:
-            print(f"  ✓ Saved to database (ID: {db_id})")
-            logging.info(f"Email downloaded: {subject} (DB ID: {db_id})")
-    except Exception as e:
-        print(f"  ❌ Database error: {e}")
-        logging.error(f"Database error for email {index}: {e}")
+    # Database insert is batched by the caller (see save_pending_emails)
+    logging.info(f"Email downloaded: {subject}")
     
     if email_folder:
-        print(f"  ✓ Email saved in folder: {email_folder}")
+        log(f"  ✓ Email saved in folder: {email_folder}")
     else:
-        print(f"  ✓ Email saved to database (no attachments)")
+        log(f"  ✓ Email queued for database (no attachments)")
     
-    return True, 'success'
+    return email_data, 'success'
+
+def process_email_buffered(email_id, fetched, index):
+    """Worker: process one email, returning its console lines with the result instead of printing them"""
+    lines = []
+    return process_downloaded_email(email_id, fetched, index, log=lines.append), lines
+
+def put_unless_stopped(items, item, stop):
+    """Put item on a bounded queue, giving up once stop is set (returns False then)"""
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def fetch_into_queue(id_list, fetched_queue, stop):
+    """Fetcher thread: the only thread using the IMAP connection (imaplib isn't thread-safe)"""
+    try:
+        for item in fetch_emails_bulk(id_list):
+            if not put_unless_stopped(fetched_queue, item, stop):
+                return
+    except Exception as e:
+        print(f"✗ Error fetching emails: {e}")
+        logging.error(f"Error fetching emails: {e}")
+    finally:
+        # End-of-stream marker
+        put_unless_stopped(fetched_queue, None, stop)
+
+def process_emails_pipeline(id_list, positions, workers=PROCESS_WORKERS):
+    """
+    Fetch and process emails concurrently, yielding (email_data, status_code) in id_list order:
+      - a fetcher thread downloads messages into a bounded queue
+      - a thread pool parses them and saves attachments meanwhile
+    The caller stays the only thread writing to the database. Each email's console lines
+    are printed as it is yielded, so the output of concurrent workers doesn't interleave
+    """
+    def finished(future):
+        result, lines = future.result()
+        if lines:
+            print('\n'.join(lines))
+        return result
+    
+    fetched_queue = queue.Queue(maxsize=FETCH_QUEUE_SIZE)
+    stop = threading.Event()
+    fetcher = threading.Thread(
+        target=fetch_into_queue, args=(id_list, fetched_queue, stop), daemon=True
+    )
+    fetcher.start()
+    
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = deque()
+            while True:
+                item = fetched_queue.get()
+                if item is None:
+                    break
+                
+                email_id, fetched = item
+                futures.append(executor.submit(process_email_buffered, email_id, fetched, positions[email_id]))
+                
+                # Hand back finished results in order; wait for the oldest when too many are in flight
+                while futures and (futures[0].done() or len(futures) >= workers * 2):
+                    yield finished(futures.popleft())
+            
+            while futures:
+                yield finished(futures.popleft())
+    finally:
+        stop.set()
+        fetcher.join()
+
+def save_pending_emails(db, pending):
+    """Insert queued emails into the database in a single transaction"""
+    if not pending:
+        return
+    
+    try:
+        inserted = db.insert_emails(pending)
+        print(f"\n💾 Saved {inserted} email(s) to database")
+        logging.info(f"Saved {inserted} of {len(pending)} queued email(s) to database")
+    except Exception as e:
+        print(f"  ❌ Database error: {e}")
+        logging.error(f"Database error while saving {len(pending)} email(s): {e}")
+    
+    pending.clear()
 
 def test_connection(server, port):
     """Test IMAP server connection"""
@@ -621,7 +979,8 @@ def main():
     print()
     
     # Initialize database
-    db = EmailDatabase(DB_FILE)
+    db = EmailDatabase(DB_FILE, driver='auto')
+    pending = []
     
     # Test connection
     if not test_connection(IMAP_SERVER, IMAP_PORT):
@@ -633,17 +992,10 @@ def main():
     print("\nConnecting to email server...")
     
     try:
-        # Connect to IMAP server
-        if USE_SSL:
-            mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-        else:
-            mail = imaplib.IMAP4(IMAP_SERVER, IMAP_PORT)
-        mail.login(EMAIL_ACCOUNT, PASSWORD)
+        # Connect to IMAP server and select inbox
+        mail = get_mail_client()
         print("✓ Connected successfully!\n")
         
-        # Select inbox
-        mail.select('INBOX')
-        
         # Search for emails
         status, messages = mail.search(None, 'ALL')
         
@@ -664,20 +1016,45 @@ def main():
             count = min(10, total_emails)
             print(f"Downloading {count} emails by default...")
         
+        # Load known email IDs once instead of querying the DB per message
+        existing_ids = db.load_existing_ids()
+        known_attachments.update(db.load_attachment_hashes())
+        
         # Download latest emails
         downloaded = 0
         skipped = 0
         blocked = 0
         
-        for i, email_id in enumerate(reversed(email_ids[-count:])):
-            result, status_code = download_email(email_id, mail, i + 1, db)
-            
-            if status_code == 'success':
-                downloaded += 1
-            elif status_code == 'exists':
+        # Emails already in the database are not fetched at all
+        selected = list(reversed(email_ids[-count:]))
+        positions = {email_id: i + 1 for i, email_id in enumerate(selected)}
+        new_ids = []
+        for email_id in selected:
+            if email_id.decode('utf-8') in existing_ids:
+                print(f"\n⏭  Email #{positions[email_id]} already exists in database - skipping")
                 skipped += 1
-            elif status_code == 'skipped':
-                blocked += 1
+            else:
+                new_ids.append(email_id)
+        
+        # Large imports: indexes and FTS triggers stay off during the download, one rebuild at
+        # the end. Decided on the new emails only, so a re-run over stored mail rebuilds nothing
+        bulk_import = len(new_ids) >= BULK_IMPORT_THRESHOLD
+        
+        with db.bulk_mode() if bulk_import else contextlib.nullcontext():
+            for email_data, status_code in process_emails_pipeline(new_ids, positions):
+                if status_code == 'success':
+                    downloaded += 1
+                    pending.append(email_data)
+                    if len(pending) >= DB_BATCH_SIZE:
+                        save_pending_emails(db, pending)
+                elif status_code == 'skipped':
+                    blocked += 1
+            
+            save_pending_emails(db, pending)
+            if bulk_import:
+                print("\nRebuilding search indexes...")
+        if bulk_import:
+            print("✓ Search indexes rebuilt")
         
         print(f"\n{'='*70}")
         print(f"DOWNLOAD COMPLETE!")
@@ -707,8 +1084,7 @@ def main():
         db.close()
         
         # Disconnect
-        mail.close()
-        mail.logout()
+        close_mail_client()
         
         print("\n✓ All done!")
         
@@ -720,6 +1096,8 @@ def main():
         logging.error(f"Error: {e}")
     finally:
         if db:
+            # Don't lose already-downloaded emails if the run was interrupted
+            save_pending_emails(db, pending)
             db.close()
 
 if __name__ == "__main__":
@@ -1,27 +1,88 @@
 import sqlite3
+import numpy as np
 import pandas as pd
+import xlsxwriter
 import os
 import sys
 import io
 import re
 import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+try:
+    import pyarrow  # optional: Arrow-backed text columns (less memory, faster str ops)
+except ImportError:
+    pyarrow = None
+
 # --- Settings ---
 DB_FILE = 'emails.db'
 OUTPUT_EXCEL_FILE = 'Email_Report.xlsx'  # Make sure this file is saved in your main folder (the base of folder_path)
+READ_CHUNK_SIZE = 50000  # Rows read (and cleaned) from the database at a time
+CLEAN_WORKERS = os.cpu_count() or 1  # Processes cleaning body_text when there is more than one chunk
 # ----------------
 
+# Tuning for the (read-only) report scan: large page cache, temp data in memory, mmap reads
+READ_PRAGMAS = (
+    'PRAGMA cache_size=-200000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+)
+
+# dtype for text columns: one contiguous Arrow buffer per column when pyarrow is installed
+STRING_DTYPE = 'string[pyarrow]' if pyarrow is not None else 'string'
+
+# Patterns used on every row, compiled once
+ZERO_WIDTH_RE = re.compile(r'[\u200B-\u200D\uFEFF]')
+HSPACE_RE = re.compile(r'[ \t\f\v]+')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+URL_PREFIX_RE = re.compile(r'^(?:external:|file:/{2,3})+', re.I)
+ABS_PATH_RE = re.compile(r'^[A-Za-z]:/|^/|^//')
+
+# Anything clean_body_text would change (besides clipping): bodies without a match are kept
+# as is. Literal characters only (no \u or \s escapes), so pyarrow's regex engine reads it
+# the same way; WHITESPACE is exactly what str.strip() removes.
+WHITESPACE = '\t\n\v\f\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000'
+NEEDS_CLEANING_RE = re.compile(
+    '[\r\t\f\v\u00A0\u200B-\u200D\uFEFF]| {2}|\n{3}'
+    f'|^[{WHITESPACE}]|[{WHITESPACE}]$'
+)
+
+
+def build_emails_query(tables):
+    """
+    Build the SELECT for the report, pulling in the side tables the database has
+    (tables maps each table name to its column names):
+      - email_bodies: HTML body, stored outside the emails table
+      - email_links: link URLs (one row per URL), reported one per line, followed by
+        the link type in parentheses where one was recorded
+    """
+    select = ['emails.*']
+    joins = []
+    if 'email_bodies' in tables:
+        select.append('email_bodies.body_html')
+        joins.append('LEFT JOIN email_bodies ON email_bodies.email_rowid = emails.id')
+    if 'email_links' in tables:
+        # Databases from before the type column are read as they are (read-only connection)
+        link = "url || IFNULL(' (' || type || ')', '')" if 'type' in tables['email_links'] else 'url'
+        select.append(
+            f'(SELECT group_concat({link}, char(10)) FROM email_links '
+            'WHERE email_links.email_rowid = emails.id) AS link_urls'
+        )
+    return f"SELECT {', '.join(select)} FROM emails {' '.join(joins)}"
+
 
 # ------------- Logging helpers (tee stdout/stderr to file) -------------
 class Tee(io.TextIOBase):
-    """A simple tee that writes to multiple streams (e.g., console and a file)."""
+    """
+    A simple tee that writes to multiple streams (e.g., console and a file).
+    Writes are left to each stream's own buffering; flush() flushes them all.
+    """
     def __init__(self, *streams):
         self.streams = streams
     def write(self, s):
         for st in self.streams:
             st.write(s)
-            st.flush()
         return len(s)
     def flush(self):
         for st in self.streams:
@@ -45,93 +106,142 @@ def tee_output(file_path, mode='a', encoding='utf-8'):
 
 
 # -------------------------- Data cleaners -----------------------------
-def clean_body_text(text, clip_to_excel_limit=True):
+def clean_body_text(texts, clip_to_excel_limit=True):
     """
-    Clean up email body text:
+    Clean up a column (Series) of email body text, vectorized over all rows:
       - Normalize newlines
       - Remove zero-width and non-breaking spaces
       - Collapse repeated horizontal spaces
       - Collapse multiple blank lines
       - Optionally clip to Excel's max cell length (32,767 chars)
+    Only the bodies that need it go through these steps (most are already clean).
+    Missing values stay missing.
     """
-    if pd.isna(text):
-        return text
-    s = str(text)
+    texts = texts.astype(STRING_DTYPE)
+    needs_cleaning = texts.str.contains(NEEDS_CLEANING_RE, regex=True, na=False)
+    if clip_to_excel_limit:
+        needs_cleaning |= (texts.str.len() > 32767).fillna(False)
+    s = texts[needs_cleaning]
 
     # Normalize line breaks
-    s = s.replace('\r\n', '\n').replace('\r', '\n')
+    s = s.str.replace('\r\n', '\n', regex=False).str.replace('\r', '\n', regex=False)
 
     # Remove non-breaking and zero-width spaces
-    s = s.replace('\u00A0', ' ')
-    s = re.sub(r'[\u200B-\u200D\uFEFF]', '', s)
+    s = s.str.replace('\u00A0', ' ', regex=False)
+    s = s.str.replace(ZERO_WIDTH_RE, '', regex=True)
 
     # Collapse repeated horizontal whitespace but keep line breaks
-    s = re.sub(r'[ \t\f\v]+', ' ', s)
+    s = s.str.replace(HSPACE_RE, ' ', regex=True)
 
     # Collapse 3+ blank lines to 2
-    s = re.sub(r'\n{3,}', '\n\n', s)
+    s = s.str.replace(BLANK_LINES_RE, '\n\n', regex=True)
 
     # Clip to Excel cell char limit if requested
-    if clip_to_excel_limit and len(s) > 32767:
-        s = s[:32760] + '…'
+    if clip_to_excel_limit:
+        s = s.mask(s.str.len() > 32767, s.str.slice(0, 32760) + '…')
 
-    return s.strip()
+    return texts.mask(needs_cleaning, s.str.strip())
 # ----------------------------------------------------------------------
 
 
-def get_excel_writer(output_path):
+def get_excel_workbook(output_path, constant_memory=True):
     """
-    Create a Pandas ExcelWriter with XlsxWriter engine and disable automatic
-    string-to-URL conversion to avoid UserWarning 1303 on long 'body_text' cells.
-    Includes a backward-compatible fallback if engine_kwargs isn't supported.
+    Create an XlsxWriter Workbook directly (rows are written straight to the sheet,
+    so pandas' ExcelWriter layer isn't needed) and disable automatic string-to-URL
+    conversion to avoid UserWarning 1303 on long 'body_text' cells.
+    constant_memory=True makes XlsxWriter flush each row as soon as the next one
+    is started (far less memory on big sheets); cells must then be written row
+    by row, in order, and autofit() is not available.
     """
-    options = {'strings_to_urls': False, 'strings_to_formulas': False}
-    try:
-        # Pandas >= 1.4
-        return pd.ExcelWriter(output_path, engine='xlsxwriter', engine_kwargs={'options': options})
-    except TypeError:
-        # Fallback for older Pandas
-        writer = pd.ExcelWriter(output_path, engine='xlsxwriter')
-        try:
-            writer.book.strings_to_urls = False
-            writer.book.strings_to_formulas = False
-        except Exception:
-            pass
-        return writer
+    options = {'strings_to_urls': False, 'strings_to_formulas': False, 'constant_memory': constant_memory}
+    return xlsxwriter.Workbook(str(output_path), options)
+
 
+def column_writers(worksheet, df):
+    """
+    Pick the XlsxWriter write method for each column once, from its dtype, so rows
+    can be written without write()'s per-cell type checks:
+      - numeric columns: write_number
+      - text columns: write_string
+      - anything else: write
+    Missing (and empty text) values are skipped, i.e. left as empty cells like write()
+    does, so the columns are written as they are, without filled-in copies.
+    """
+    def write_optional_number(row, col, value):
+        if not pd.isna(value):
+            worksheet.write_number(row, col, value)
+
+    def write_text(row, col, value):
+        # NA/NaN aren't str, and '' would otherwise be stored as an empty string cell
+        if isinstance(value, str) and value:
+            worksheet.write_string(row, col, value)
+
+    def write_any(row, col, value):
+        if not pd.isna(value):
+            worksheet.write(row, col, value)
+
+    writers = []
+    for col in df.columns:
+        column = df[col]
+        if pd.api.types.is_numeric_dtype(column):
+            writers.append(write_optional_number if column.hasnans else worksheet.write_number)
+        elif pd.api.types.is_string_dtype(column):
+            writers.append(write_text)
+        else:
+            writers.append(write_any)
+    return writers
 
-def to_external_relative_folder_url(rel_path_str):
+
+def column_widths(df, max_width=255):
+    """
+    Width of each column for set_column(), a stand-in for autofit() (which is not
+    available in constant_memory mode): the longest value or header, in characters,
+    capped at max_width.
+    """
+    widths = []
+    for col in df.columns:
+        column = df[col]
+        if not pd.api.types.is_string_dtype(column):
+            column = column.astype(STRING_DTYPE)
+        longest = column.str.len().max()
+        if pd.isna(longest):
+            longest = 0
+        widths.append(min(max(len(str(col)), int(longest)) + 1, max_width))
+    return widths
+
+
+def to_external_relative_folder_urls(rel_paths):
     """
-    Build an Excel 'external:' hyperlink from a relative folder path.
-    - rel_path_str must be relative to the workbook location (the main folder).
+    Build Excel 'external:' hyperlinks from a column (Series) of relative folder paths,
+    vectorized over all rows. Empty or missing paths give None. Each distinct path is
+    converted once (many rows share one, e.g. the empty path of emails without files).
+    - Paths must be relative to the workbook location (the main folder).
     - Use forward slashes for cross-platform compatibility.
     - Explicitly prefix with './' if it doesn't start with './' or '../'
     - Add a trailing '/' so Excel treats it as a folder link (opens folder).
     """
-    if pd.isna(rel_path_str):
-        return None
-
-    p = str(rel_path_str).strip()
-    if not p:
-        return None
+    codes, uniques = pd.factorize(rel_paths)  # missing paths get code -1
+    p = pd.Series(uniques, dtype=object).astype(STRING_DTYPE).fillna('').str.strip()
+    has_path = (p != '').to_numpy(dtype=bool)
 
     # Normalize: remove accidental URL prefixes and normalize separators
-    p = re.sub(r'^(?:external:|file:/{2,3})+', '', p, flags=re.I)
-    p = p.replace('\\', '/')
+    p = p.str.replace(URL_PREFIX_RE, '', regex=True)
+    p = p.str.replace('\\', '/', regex=False)
 
     # If it is absolute (starts with drive, UNC, or root), we keep it,
     # but note: it won't be portable when moving drives
-    is_abs = bool(re.match(r'^[A-Za-z]:/|^/|^//', p))
-    if not is_abs:
-        # Ensure explicit relative indicator
-        if not p.startswith(('./', '../')):
-            p = './' + p
+    is_abs = p.str.match(ABS_PATH_RE)
+
+    # Ensure explicit relative indicator
+    p = p.mask(~is_abs & ~p.str.startswith(('./', '../')), './' + p)
 
     # Add trailing slash to indicate a folder
-    if not p.endswith('/'):
-        p += '/'
+    p = p.mask(~p.str.endswith('/'), p + '/')
+
+    urls = ('external:' + p).astype(object).where(has_path, None).to_numpy()
 
-    return 'external:' + p
+    # Back to one URL per row (code -1 picks the None appended at the end)
+    return pd.Series(np.append(urls, None)[codes], index=rel_paths.index, dtype=object)
 
 
 def export_db_to_excel(db_path, output_path):
@@ -155,63 +265,85 @@ def export_db_to_excel(db_path, output_path):
         except Exception:
             excel_dir = output_path.absolute().parent
 
-        # 1) Read from DB
+        # 1) Read from DB in chunks, and 2) clean body_text chunk by chunk, so the
+        # raw rows and the uncleaned bodies never all live in memory at once.
+        # Tables bigger than one chunk are cleaned in worker processes, in parallel
+        # with reading the next chunks.
         print("Connecting to the database and reading data...")
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql_query("SELECT * FROM emails", conn)
-        conn.close()
+        conn = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        tables = {
+            name: {column[1] for column in conn.execute(f'PRAGMA table_info("{name}")')}
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        }
+        row_count = conn.execute("SELECT count(*) FROM emails").fetchone()[0]
+        use_pool = CLEAN_WORKERS > 1 and row_count > READ_CHUNK_SIZE
+
+        chunks = []
+        pending = []  # (chunk, future cleaning its body_text)
+        with ProcessPoolExecutor(CLEAN_WORKERS) if use_pool else contextlib.nullcontext() as pool:
+            for chunk in pd.read_sql_query(build_emails_query(tables), conn, chunksize=READ_CHUNK_SIZE):
+                text_cols = [c for c in chunk.columns if pd.api.types.is_string_dtype(chunk[c])]
+                chunk[text_cols] = chunk[text_cols].astype(STRING_DTYPE)
+                if 'body_text' in chunk.columns:
+                    if pool is not None:
+                        pending.append((chunk, pool.submit(clean_body_text, chunk['body_text'])))
+                    else:
+                        chunk['body_text'] = clean_body_text(chunk['body_text'])
+                chunks.append(chunk)
+            conn.close()
+
+            for chunk, future in pending:
+                chunk['body_text'] = future.result()
+        df = pd.concat(chunks, ignore_index=True)
         print(f"✓ {len(df)} records read from the database.")
 
-        # 2) Clean body_text
-        if 'body_text' in df.columns:
-            df['body_text'] = df['body_text'].apply(clean_body_text)
-
-        # 3) Prepare link column
+        # 3) Prepare link column text (the same for every row)
         if 'folder_path' in df.columns:
-            df['link_display_text'] = "Open Folder"
+            link_text = "Open Folder"
         else:
             print("⚠ Column 'folder_path' not found in the database. Hyperlinks will not be created.")
             df['folder_path'] = ''
-            df['link_display_text'] = 'N/A'
+            link_text = 'N/A'
 
         # 4) Write to Excel
         print(f"Writing data to Excel file: {output_path} ...")
 
         log_path = Path(output_path).with_suffix('.log')
         with tee_output(log_path, mode='a'):
-            with get_excel_writer(output_path) as writer:
-                # Place the manual link column at the end
-                cols = [c for c in df.columns if c not in ['link_display_text']]
-                df = df.rename(columns={'link_display_text': 'Folder Link'})
-                final_cols = cols + ['Folder Link']
-
-                # Write the data
-                df[final_cols].to_excel(writer, sheet_name='Emails', index=False, freeze_panes=(1, 0))
+            with get_excel_workbook(output_path) as workbook:
+                # The manual link column goes after the data, under the header 'Folder Link'
+                data_cols = list(df.columns)
 
-                workbook = writer.book
-                worksheet = writer.sheets['Emails']
+                worksheet = workbook.add_worksheet('Emails')
+                header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
                 url_format = workbook.add_format({'font_color': 'blue', 'underline': 1})
 
-                try:
-                    link_text_col_idx = final_cols.index('Folder Link')
-                    folder_path_col_idx = df.columns.get_loc('folder_path')
-                except ValueError:
-                    print("⚠ Required columns for creating links were not found.")
-                    return
-
-                # Create 'external:' relative links for each row
-                for row_num in range(1, len(df) + 1):
-                    rel_folder_path = df.iloc[row_num - 1, folder_path_col_idx]
-                    link_text = df.iloc[row_num - 1, df.columns.get_loc('Folder Link')]
-
-                    if rel_folder_path and pd.notna(rel_folder_path):
-                        url = to_external_relative_folder_url(rel_folder_path)
-                        if url:
-                            worksheet.write_url(row_num, link_text_col_idx, url, cell_format=url_format, string=str(link_text))
-
-                # Auto-fit columns if available (newer XlsxWriter). Safe no-op otherwise.
-                if hasattr(worksheet, 'autofit'):
-                    worksheet.autofit()
+                writers = column_writers(worksheet, df)
+                widths = column_widths(df) + [max(len('Folder Link'), len(link_text)) + 1]
+                for col_num, width in enumerate(widths):
+                    worksheet.set_column(col_num, col_num, width)
+
+                # Write the data straight to the sheet, in one pass and strictly row by
+                # row (constant_memory flushes each row): header, then one row per email
+                # with its 'external:' relative folder link; missing values become empty cells
+                worksheet.freeze_panes(1, 0)
+                worksheet.write_row(0, 0, data_cols + ['Folder Link'], header_format)
+                link_text_col_idx = len(data_cols)
+                urls = to_external_relative_folder_urls(df['folder_path'])
+                rows = df.itertuples(index=False, name=None)
+
+                # Hot loop: the URL writers and format bound to locals once
+                write_url = worksheet.write_url
+                write_string = worksheet.write_string
+                for row_num, (values, url) in enumerate(zip(rows, urls), start=1):
+                    for col_num, (write, value) in enumerate(zip(writers, values)):
+                        write(row_num, col_num, value)
+                    # Past Excel's 65,530 links per sheet write_url returns -2 and writes
+                    # nothing, so the cell still gets its text
+                    if not url or write_url(row_num, link_text_col_idx, url, url_format, link_text) < 0:
+                        write_string(row_num, link_text_col_idx, link_text)
 
             print(f"✓ Excel file created successfully at '{output_path}'.")
 